@@ -1,13 +1,16 @@
 # app.py
 
 import streamlit as st
-import json
+import hashlib
+import time
+import orjson
 import logging
 from io import BytesIO
 from streamlit_flow import streamlit_flow
 from streamlit_flow.elements import StreamlitFlowNode, StreamlitFlowEdge
 from streamlit_flow.state import StreamlitFlowState
-from streamlit_flow.layouts import LayeredLayout
+from streamlit_flow.layouts import LayeredLayout, ManualLayout
+from dag_to_flow import build_nodes_edges
 
 st.set_page_config(
     page_title="Conductor Process Flow Visualizer",
@@ -19,8 +22,11 @@ st.set_page_config(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Define a simple logging decorator
+# Define a simple logging decorator; a passthrough when INFO logging is disabled
 def with_logging(func):
+    if not logger.isEnabledFor(logging.INFO):
+        return func
+
     def wrapper(*args, **kwargs):
         logger.info(f"Starting '{func.__name__}'")
         result = func(*args, **kwargs)
@@ -28,238 +34,245 @@ def with_logging(func):
         return result
     return wrapper
 
+# Parse the uploaded DAG JSON; cached on the file bytes so reruns skip the decode. The cache
+# is shared by all sessions, so keep only the most recent uploads
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_dag(file_bytes):
+    return orjson.loads(file_bytes)
+
+# Convert a flow node back to its unit operation JSON
+def _node_to_json(node_id, node):
+    # Ensure position exists and has 'x' and 'y'
+    position = node.position if hasattr(node, 'position') else {'x': 0, 'y': 0}
+    get = node.data.get
+    return {
+        "unit_operation_id": node_id,
+        "name": get('content', ''),
+        "description": get('description', ''),
+        "unit_operation_type": get('unit_operation_type', ''),
+        "order": get('order', 0),
+        "input_streams": get('input_streams', []),
+        "output_streams": get('output_streams', []),
+        "parameters": get('parameters', {}),
+        "additional_info": get('additional_info', ''),
+        "position": {
+            "x": int(position.get('x', 0)),
+            "y": int(position.get('y', 0))
+        }
+    }
+
+# Convert a flow edge back to its stream JSON
+def _edge_to_json(edge):
+    return {
+        "stream_id": edge.id,
+        "source": edge.source,
+        "target": edge.target,
+        "name": edge.label,
+        "stream_type": "core" if edge.animated else "other"
+    }
+
+# Rebuild the downloadable DAG dict from the current flow state
+def build_updated_dag(nodes_by_id, edges):
+    return {
+        "unit_operations": {node_id: _node_to_json(node_id, node) for node_id, node in nodes_by_id.items()},
+        "streams": {edge.id: _edge_to_json(edge) for edge in edges}
+    }
+
+# Run a function as a Streamlit fragment so its widgets rerun only that function;
+# falls back to a plain call on Streamlit versions without fragments
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+# Sidebar form for editing the selected node's fields
+def edit_node_form(selected_node):
+    st.markdown("### Edit Selected Node")
+
+    # Show a parameters error from the last submit, which triggered a rerun before it could render
+    params_error = st.session_state.pop('params_error', None)
+    if params_error:
+        st.error(params_error)
+
+    node_content = selected_node.data.get('content', '')
+    node_description = selected_node.data.get('description', '')
+    node_type = selected_node.data.get('unit_operation_type', '')
+    node_order = selected_node.data.get('order', 0)
+    node_input_streams = selected_node.data.get('input_streams', [])
+    node_output_streams = selected_node.data.get('output_streams', [])
+    node_parameters = selected_node.data.get('parameters', {})
+    node_additional_info = selected_node.data.get('additional_info', '')
+
+    # Serialize parameters for editing only when a state rebuild or a sidebar edit may have
+    # changed them; the build counter never repeats, even when the same file is re-uploaded
+    params_key = f'params_str_{selected_node.id}'
+    params_version = (st.session_state.get('state_builds', 0), st.session_state.get('dag_edits', 0))
+    cached_params = st.session_state.get(params_key)
+    if cached_params is None or cached_params[0] != params_version:
+        cached_params = (params_version, orjson.dumps(node_parameters, option=orjson.OPT_INDENT_2).decode())
+        st.session_state[params_key] = cached_params
+    node_parameters_str = cached_params[1]
+
+    with st.form(key="node_edit_form"):
+        new_name = st.text_input("Name", node_content)
+        new_description = st.text_area("Description", node_description)
+        new_unit_type = st.text_input("Unit Operation Type", node_type)
+        new_order = st.number_input("Order", value=node_order)
+        new_input_streams_str = st.text_area("Input Streams (comma-separated)", ",".join(node_input_streams))
+        new_output_streams_str = st.text_area("Output Streams (comma-separated)", ",".join(node_output_streams))
+
+        st.markdown("#### Parameters")
+        # Simple way to edit parameters: show a text area with JSON
+        parameters_str = st.text_area("Parameters (JSON)", node_parameters_str)
+
+        new_additional_info = st.text_area("Additional Info", node_additional_info)
+
+        if st.form_submit_button("Update Node"):
+            # Update the node's data
+            selected_node.data['content'] = new_name
+            selected_node.data['description'] = new_description
+            selected_node.data['unit_operation_type'] = new_unit_type
+            selected_node.data['order'] = new_order
+            selected_node.data['input_streams'] = [s.strip() for s in new_input_streams_str.split(',') if s.strip()]
+            selected_node.data['output_streams'] = [s.strip() for s in new_output_streams_str.split(',') if s.strip()]
+
+            # Parse parameters JSON
+            try:
+                updated_params = orjson.loads(parameters_str)
+            except orjson.JSONDecodeError as e:
+                st.session_state['params_error'] = f"Invalid JSON for parameters ({e}). Reverting to old parameters."
+                updated_params = node_parameters
+            selected_node.data['parameters'] = updated_params
+            selected_node.data['additional_info'] = new_additional_info
+
+            # Count the edit so cached views of the DAG are rebuilt, and bump the state's
+            # timestamp so the component takes the edited node instead of its own copy
+            st.session_state['dag_edits'] = st.session_state.get('dag_edits', 0) + 1
+            st.session_state['curr_state'].timestamp = int(time.time() * 1000)
+
+            # Trigger a rerun to show updated changes in the DAG
+            st.experimental_rerun()
+
+# Preview and download of the updated DAG
+@fragment
+def dag_preview(updated_dag):
+    # Display updated DAG only on request, since st.json ships the whole dict to the browser
+    st.write("### Updated state of the DAG:")
+    if st.checkbox("Show updated DAG JSON", value=False):
+        st.json(updated_dag)
+
+    # Prepare download content, serializing once per flow state change
+    if st.session_state['updated_dag_json'] is None:
+        st.session_state['updated_dag_json'] = orjson.dumps(updated_dag, option=orjson.OPT_INDENT_2)
+    updated_dag_json = st.session_state['updated_dag_json']
+    st.download_button(
+        label="Download Updated DAG JSON",
+        data=updated_dag_json,
+        file_name="updated_dag.json",
+        mime="application/json"
+    )
+
 @with_logging
 def main():
     st.title("DAG Visualization & Editing")
     st.write("Upload and visualize a DAG JSON file. Interactively add, edit, or delete nodes and edges.")
 
-    # Function to load DAG from uploaded file
-    def load_dag(uploaded_file):
-        try:
-            data = json.load(uploaded_file)
-            st.success("DAG JSON uploaded successfully.")
-            return data
-        except Exception as e:
-            st.error(f"Error reading JSON file: {e}")
-            return None
-
     # File uploader
     uploaded_file = st.file_uploader("Upload DAG JSON file", type=["json"])
 
     if uploaded_file is not None:
-        # Load the DAG
-        dag_data = load_dag(uploaded_file)
-
-        if dag_data:
-            # Extract nodes and edges
-            nodes_data = dag_data.get('unit_operations', {})
-            edges_data = dag_data.get('streams', {})
-
-            # Collect node IDs for validation
-            node_ids = set()
-            for node in nodes_data.values():
-                node_id = node.get('unit_operation_id', '')
-                if node_id:
-                    node_ids.add(node_id)
-
-            # Map nodes to StreamlitFlowNodes
-            nodes = []
-            for node in nodes_data.values():
-                node_id = node.get('unit_operation_id', '')
-                node_name = node.get('name', '')
-                if not node_id:
-                    continue  # Skip nodes without an ID
-
-                # Determine node type
-                node_type = 'default'
-                # If no incoming edges, consider it an "input" node
-                if not any(edge['target'] == node_id for edge in edges_data.values()):
-                    node_type = 'input'
-                # If no outgoing edges, consider it an "output" node
-                if not any(edge['source'] == node_id for edge in edges_data.values()):
-                    node_type = 'output'
-
-                # Set positions (will be laid out automatically)
-                source_position = 'right'
-                target_position = 'left'
-
-                # Put full node info into node.data so we can retrieve it later
-                node_data_dict = {
-                    'content': node_name,
-                    'description': node.get('description', ''),
-                    'unit_operation_type': node.get('unit_operation_type', ''),
-                    'order': node.get('order', None),
-                    'input_streams': node.get('input_streams', []),
-                    'output_streams': node.get('output_streams', []),
-                    'parameters': node.get('parameters', {}),
-                    'additional_info': node.get('additional_info', '')
-                }
-
-                st_node = StreamlitFlowNode(
-                    id=node_id,
-                    pos=(0, 0),  # Positions will be auto-laid out anyway
-                    data=node_data_dict,
-                    node_type=node_type,
-                    source_position=source_position,
-                    target_position=target_position,
-                    deletable=True
-                )
-                nodes.append(st_node)
-
-            # Map edges to StreamlitFlowEdges
-            edges = []
-            for edge in edges_data.values():
-                stream_id = edge.get('stream_id', '')
-                source = edge.get('source', '')
-                target = edge.get('target', '')
-                edge_name = edge.get('name', '')
-                stream_type = edge.get('stream_type', '')
-                animated = True if stream_type == 'core' else False
-
-                if source not in node_ids or target not in node_ids:
-                    st.warning(f"Edge {stream_id} refers to unknown node(s): source={source}, target={target}")
-                    continue
-
-                st_edge = StreamlitFlowEdge(
-                    id=stream_id,
-                    source=source,
-                    target=target,
-                    label=edge_name,
-                    animated=animated,
-                    deletable=True
+        file_bytes = uploaded_file.getvalue()
+        file_digest = hashlib.md5(file_bytes).hexdigest()
+
+        # Load the DAG and build the flow state once per uploaded file; afterwards the state
+        # returned by the component is authoritative and is passed straight back in
+        if st.session_state.get('curr_state_file') != file_digest:
+            try:
+                dag_data = load_dag(file_bytes)
+                st.success("DAG JSON uploaded successfully.")
+            except Exception as e:
+                st.error(f"Error reading JSON file: {e}")
+                dag_data = None
+
+            if dag_data:
+                # Map nodes and edges to StreamlitFlow elements
+                node_dicts, edge_dicts, skipped_edges = build_nodes_edges(
+                    dag_data.get('unit_operations', {}),
+                    dag_data.get('streams', {})
                 )
-                edges.append(st_edge)
-
-            # Initialize state
-            initial_state = StreamlitFlowState(nodes=nodes, edges=edges)
+                nodes = [StreamlitFlowNode(**d) for d in node_dicts]
+                edges = [StreamlitFlowEdge(**d) for d in edge_dicts]
+
+                st.session_state['curr_state'] = StreamlitFlowState(nodes=nodes, edges=edges)
+                st.session_state['curr_state_file'] = file_digest
+                st.session_state['state_builds'] = st.session_state.get('state_builds', 0) + 1
+                st.session_state['skipped_edges'] = skipped_edges
+                st.session_state['laid_out'] = False
+
+        if st.session_state.get('curr_state_file') == file_digest:
+            for stream_id, source, target in st.session_state['skipped_edges']:
+                st.warning(f"Edge {stream_id} refers to unknown node(s): source={source}, target={target}")
+
+            # Auto-layout only on the first render of a file; afterwards the positions carried
+            # by the state are kept as they are
+            curr_state = st.session_state['curr_state']
+            passed_timestamp = curr_state.timestamp
+            if st.session_state['laid_out']:
+                layout = ManualLayout()
+            else:
+                layout = LayeredLayout(direction='right')
 
             st.markdown("### Interactively edit the DAG below")
 
-            # Make the flow fully interactive
+            # Make the flow fully interactive; keying on the file content remounts the
+            # component only when a different DAG is uploaded
             new_state = streamlit_flow(
-                'fully_interactive_dag',
-                initial_state,
+                f'dag_{file_digest[:8]}',
+                curr_state,
                 fit_view=True,
                 show_controls=True,
                 allow_new_edges=True,
                 animate_new_edges=True,
-                layout=LayeredLayout(direction='right'),
+                layout=layout,
                 enable_pane_menu=True,
                 enable_edge_menu=True,
                 enable_node_menu=True,
             )
+            st.session_state['curr_state'] = new_state
+            # Positions are only real once the component has returned a state of its own
+            if new_state.timestamp != passed_timestamp:
+                st.session_state['laid_out'] = True
 
             # Display updated metrics
             col1, col2 = st.columns(2)
             col1.metric("Nodes", len(new_state.nodes))
             col2.metric("Edges", len(new_state.edges))
 
+            # Index nodes by ID for the selection lookup and download preparation
+            nodes_by_id = {n.id: n for n in new_state.nodes}
+
             # If a node is selected, allow editing its fields
             selected_node_id = new_state.selected_id
             if selected_node_id:
                 # Find the node
-                selected_node = None
-                for n in new_state.nodes:
-                    if n.id == selected_node_id:
-                        selected_node = n
-                        break
+                selected_node = nodes_by_id.get(selected_node_id)
 
                 if selected_node:
                     with st.sidebar:
-                        st.markdown("### Edit Selected Node")
-                        node_content = selected_node.data.get('content', '')
-                        node_description = selected_node.data.get('description', '')
-                        node_type = selected_node.data.get('unit_operation_type', '')
-                        node_order = selected_node.data.get('order', 0)
-                        node_input_streams = selected_node.data.get('input_streams', [])
-                        node_output_streams = selected_node.data.get('output_streams', [])
-                        node_parameters = selected_node.data.get('parameters', {})
-                        node_additional_info = selected_node.data.get('additional_info', '')
-
-                        with st.form(key="node_edit_form"):
-                            new_name = st.text_input("Name", node_content)
-                            new_description = st.text_area("Description", node_description)
-                            new_unit_type = st.text_input("Unit Operation Type", node_type)
-                            new_order = st.number_input("Order", value=node_order)
-                            new_input_streams_str = st.text_area("Input Streams (comma-separated)", ",".join(node_input_streams))
-                            new_output_streams_str = st.text_area("Output Streams (comma-separated)", ",".join(node_output_streams))
-
-                            st.markdown("#### Parameters")
-                            # Simple way to edit parameters: show a text area with JSON
-                            parameters_str = st.text_area("Parameters (JSON)", json.dumps(node_parameters, indent=2))
-
-                            new_additional_info = st.text_area("Additional Info", node_additional_info)
-
-                            if st.form_submit_button("Update Node"):
-                                # Update the node's data
-                                selected_node.data['content'] = new_name
-                                selected_node.data['description'] = new_description
-                                selected_node.data['unit_operation_type'] = new_unit_type
-                                selected_node.data['order'] = new_order
-                                selected_node.data['input_streams'] = [s.strip() for s in new_input_streams_str.split(',') if s.strip()]
-                                selected_node.data['output_streams'] = [s.strip() for s in new_output_streams_str.split(',') if s.strip()]
-
-                                # Parse parameters JSON
-                                try:
-                                    updated_params = json.loads(parameters_str)
-                                except json.JSONDecodeError:
-                                    st.error("Invalid JSON for parameters. Reverting to old parameters.")
-                                    updated_params = node_parameters
-                                selected_node.data['parameters'] = updated_params
-                                selected_node.data['additional_info'] = new_additional_info
-
-                                # Trigger a rerun to show updated changes in the DAG
-                                st.experimental_rerun()
-
-            # Prepare updated DAG for download
-            updated_dag = {
-                "unit_operations": {},
-                "streams": {}
-            }
-
-            # Process updated nodes
-            for node in new_state.nodes:
-                # Ensure position exists and has 'x' and 'y'
-                position = node.position if hasattr(node, 'position') else {'x': 0, 'y': 0}
-                updated_dag["unit_operations"][node.id] = {
-                    "unit_operation_id": node.id,
-                    "name": node.data.get('content', ''),
-                    "description": node.data.get('description', ''),
-                    "unit_operation_type": node.data.get('unit_operation_type', ''),
-                    "order": node.data.get('order', 0),
-                    "input_streams": node.data.get('input_streams', []),
-                    "output_streams": node.data.get('output_streams', []),
-                    "parameters": node.data.get('parameters', {}),
-                    "additional_info": node.data.get('additional_info', ''),
-                    "position": {
-                        "x": int(position.get('x', 0)),
-                        "y": int(position.get('y', 0))
-                    }
-                }
-
-            # Process updated edges
-            for edge in new_state.edges:
-                updated_dag["streams"][edge.id] = {
-                    "stream_id": edge.id,
-                    "source": edge.source,
-                    "target": edge.target,
-                    "name": edge.label,
-                    "stream_type": "core" if edge.animated else "other"
-                }
-
-            # Display updated DAG
-            st.write("### Updated state of the DAG:")
-            st.json(updated_dag)
-
-            # Prepare download content
-            updated_dag_json = json.dumps(updated_dag, indent=2)
-            st.download_button(
-                label="Download Updated DAG JSON",
-                data=updated_dag_json,
-                file_name="updated_dag.json",
-                mime="application/json"
-            )
+                        edit_node_form(selected_node)
+
+            # Prepare updated DAG for download, rebuilding only when the flow state changed:
+            # the component bumps its timestamp on every frontend change, and sidebar edits
+            # bump the edit counter
+            dag_key = (file_digest, new_state.timestamp, st.session_state.get('dag_edits', 0))
+            if st.session_state.get('updated_dag_key') != dag_key:
+                st.session_state['updated_dag'] = build_updated_dag(nodes_by_id, new_state.edges)
+                st.session_state['updated_dag_json'] = None
+                st.session_state['updated_dag_key'] = dag_key
+            updated_dag = st.session_state['updated_dag']
+
+            dag_preview(updated_dag)
     else:
+        # Forget the previous file's state so re-uploading it starts again from its contents
+        st.session_state.pop('curr_state', None)
+        st.session_state.pop('curr_state_file', None)
         st.info("Please upload a DAG JSON file to get started.")
 
 if __name__ == "__main__":
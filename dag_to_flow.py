@@ -0,0 +1,76 @@
+# dag_to_flow.py
+
+# Put full node info into node.data so we can retrieve it later
+def _build_data(node):
+    return {
+        'content': node.get('name', ''),
+        'description': node.get('description', ''),
+        'unit_operation_type': node.get('unit_operation_type', ''),
+        'order': node.get('order', None),
+        'input_streams': node.get('input_streams', []),
+        'output_streams': node.get('output_streams', []),
+        'parameters': node.get('parameters', {}),
+        'additional_info': node.get('additional_info', '')
+    }
+
+# Determine node type from its edge endpoints
+def _classify(node_id, edge_sources, edge_targets):
+    # If no incoming edges, consider it an "input" node
+    if node_id not in edge_targets:
+        return 'input'
+    # Otherwise, if no outgoing edges, consider it an "output" node
+    if node_id not in edge_sources:
+        return 'output'
+    return 'default'
+
+# Map DAG JSON nodes and edges to StreamlitFlowNode/StreamlitFlowEdge kwargs.
+# Returns plain dicts (rather than element objects) so callers can cache the result.
+def build_nodes_edges(nodes_data, edges_data):
+    # Collect node IDs for validation
+    node_ids = {node_id for node in nodes_data.values() if (node_id := node.get('unit_operation_id', ''))}
+
+    # Collect edge endpoints once so node classification is a set lookup
+    edge_targets = frozenset(edge.get('target', '') for edge in edges_data.values())
+    edge_sources = frozenset(edge.get('source', '') for edge in edges_data.values())
+
+    # Map nodes to StreamlitFlowNode kwargs, skipping nodes without an ID.
+    # Positions are auto-laid out, with edges leaving right and entering left.
+    node_dicts = [
+        {
+            'id': node_id,
+            'pos': (0, 0),
+            'data': _build_data(node),
+            'node_type': _classify(node_id, edge_sources, edge_targets),
+            'source_position': 'right',
+            'target_position': 'left',
+            'deletable': True
+        }
+        for node in nodes_data.values()
+        if (node_id := node.get('unit_operation_id', ''))
+    ]
+
+    # Map edges to StreamlitFlowEdge kwargs, collecting any that reference unknown nodes
+    edge_dicts = []
+    skipped_edges = []
+    for edge in edges_data.values():
+        stream_id = edge.get('stream_id', '')
+        source = edge.get('source', '')
+        target = edge.get('target', '')
+        edge_name = edge.get('name', '')
+        stream_type = edge.get('stream_type', '')
+        animated = stream_type == 'core'
+
+        if source not in node_ids or target not in node_ids:
+            skipped_edges.append((stream_id, source, target))
+            continue
+
+        edge_dicts.append({
+            'id': stream_id,
+            'source': source,
+            'target': target,
+            'label': edge_name,
+            'animated': animated,
+            'deletable': True
+        })
+
+    return node_dicts, edge_dicts, skipped_edges